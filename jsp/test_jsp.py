@@ -3,90 +3,544 @@
 # This script is to help use test-driven development to implement
 # business logic in the slurm job_submit.lua plugin.
 
+import asyncio
+import copy
+import random
 import re
 import shlex
+import shutil
 import subprocess
+import threading
 import unittest
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
 from os import getenv
+from time import monotonic, sleep, time
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from orjson import loads as json_loads  # faster decode of large job payloads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    import httpx  # optional: only needed for the async fan-out helpers
+except ImportError:
+    httpx = None
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
 
 # ------------------ User-configurable variables (edit here) ------------------
 SLURM_CONTROLLER = "http://localhost:6820"
+SLURM_REST_CACHE_URL = None                        # optional caching proxy in front of SLURM_CONTROLLER, used for GETs
 API_VERSION = "v0.0.40"
 TEMPORARY_ADDITIONS = " -A root "          # extra sbatch params added during tests
 SBATCH_BEGIN = '--begin="now+1second"'             # when to begin job
 SBATCH_WRAP = '--wrap="sleep 1"'                   # wrapper for sbatch
-SCONTROL_CMD = ["scontrol", "token"]               # command used to fetch token
+TOKEN_LIFESPAN = 1800                              # seconds a fetched token stays valid
+SCONTROL_CMD = ["scontrol", "token", f"lifespan={TOKEN_LIFESPAN}"]  # command used to fetch token
+REST_TIMEOUT = (2, 10)                             # (connect, read) seconds per REST call
+REST_MAX_INFLIGHT = 64                             # REST calls in flight across all test workers (slurmrestd falls over near ~125)
+REST_ATTEMPTS = 4                                  # tries per GET on throttling/transient errors
+ETAG_CACHE_SIZE = 128                              # most recent GET bodies kept for If-None-Match
+QOS_CACHE_TTL = 60                                 # seconds a user's QoS lookup is reused
+USE_RESTD = False                                  # submit via POST job/submit instead of sbatch
+REST_JOB_SCRIPT = "#!/bin/sh\nsleep 1\n"           # REST equivalent of SBATCH_WRAP
+REST_JOB_DEFAULTS = {"account": "root",            # REST equivalent of TEMPORARY_ADDITIONS
+                     "current_working_directory": "/tmp",
+                     "environment": ["PATH=/bin:/usr/bin"]}
 # ---------------------------------------------------------------------------
+# A minimal nginx front for SLURM_REST_CACHE_URL (1s is enough to absorb polling loops):
+#   proxy_cache_path /var/cache/nginx/slurmrestd keys_zone=STATIC:10m;
+#   server {
+#       listen 6821;
+#       location / {
+#           proxy_pass http://localhost:6820;
+#           proxy_cache STATIC;
+#           proxy_cache_key "$request_uri$http_x_slurm_user_token";
+#           proxy_cache_valid 200 1s;
+#       }
+#   }
+
+# Environment read once at import
+_ENV_JWT = getenv('SLURM_JWT')
+_ENV_USER = getenv('USER')
+_ENV_MAX_INFLIGHT = getenv('SLURM_REST_MAX_INFLIGHT')       # overrides REST_MAX_INFLIGHT
+_ENV_XDIST_WORKERS = getenv('PYTEST_XDIST_WORKER_COUNT')   # set by pytest -n
+
+# Each process gets an equal share of the total, so pytest -n N stays under the same ceiling.
+_MAX_INFLIGHT = max(1, int(_ENV_MAX_INFLIGHT or REST_MAX_INFLIGHT) // int(_ENV_XDIST_WORKERS or 1))
+
+# Pre-split pieces of every submission, so each run() only tokenizes its own params.
+# sbatch is resolved to an absolute path because subprocess only takes its posix_spawn fast
+# path (no fork of this process) for an executable with a directory component, no shell,
+# no preexec_fn/cwd/pass_fds, and close_fds=False.
+_SBATCH_ARGV = (shutil.which("sbatch") or "sbatch", *shlex.split(SBATCH_BEGIN), *shlex.split(SBATCH_WRAP), *shlex.split(TEMPORARY_ADDITIONS))
+_JOBID_RE = re.compile(rb'Submitted batch job (\d+)')  # sbatch output is kept as bytes
+
+# sbatch options run() knows how to translate into a REST job description
+_REST_OPTIONS = {"-p": "partition", "--partition": "partition",
+                 "-A": "account", "--account": "account",
+                 "-J": "name", "--job-name": "name",
+                 "--mem": "memory_per_node"}
+_MEM_RE = re.compile(r'(\d+)([KMGT]?)', re.IGNORECASE)  # the --mem forms run() translates
+_MEM_UNITS_KB = {"K": 1, "": 1024, "M": 1024, "G": 1024 ** 2, "T": 1024 ** 3}
+
+# URL prefixes per resource: reads may go through the caching proxy; writes and reads that
+# must be current (e.g. jobs submitted a moment ago) go straight to the controller.
+_READ_URL_PREFIX = {res: f"{SLURM_REST_CACHE_URL or SLURM_CONTROLLER}/{res}/{API_VERSION}/"
+                    for res in ('slurm', 'slurmdb')}
+_DIRECT_URL_PREFIX = {res: f"{SLURM_CONTROLLER}/{res}/{API_VERSION}/" for res in ('slurm', 'slurmdb')}
+
+# Shared HTTP session so every REST call reuses the same pooled connection and token header.
+# Built lazily by get_session(), so each test process (or xdist worker) resolves its own token.
+SESSION = None
+_SESSION_LOCK = threading.Lock()
+# Worker threads for issuing independent REST calls in parallel over SESSION's pool.
+_POOL = ThreadPoolExecutor(max_workers=8)
+# Caps concurrent sync calls from every thread in this process to its share of the limit.
+_INFLIGHT = threading.BoundedSemaphore(_MAX_INFLIGHT)
+# Connection pool size of the async client (make_async_client).
+_ASYNC_MAX_CONNECTIONS = 32
+# Statuses worth retrying; slurmrestd answers plain query errors (e.g. unknown job) with 500.
+_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# Every job state slurm treats as finished.
+_TERMINAL_STATES = ('BOOT_FAIL', 'CANCELLED', 'COMPLETED', 'DEADLINE', 'FAILED',
+                    'NODE_FAIL', 'OUT_OF_MEMORY', 'PREEMPTED', 'TIMEOUT')
+# url -> (etag, json, status_code) of the last GET, replayed when the server answers 304.
+# Bounded to ETAG_CACHE_SIZE entries, oldest first out, so polled job/{id} bodies don't pile up.
+_ETAGS = {}
+_ETAGS_LOCK = threading.Lock()
 
 class SlurmSubmissionError(Exception):
     def __init__(self, message, full_output):
         super().__init__(message)
         self.output = full_output
 
+class SlurmRestError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(status_code, text)
+        self.status_code = status_code
+        self.text = text  # full response body
+        # slurmrestd puts the reason in errors[0].description, behind a long meta block
+        self.errors, self.description = [], None
+        try:
+            self.errors = json_loads(text)['errors']
+            self.description = self.errors[0]['description']
+        except (ValueError, KeyError, IndexError, TypeError):
+            pass
+
+    def __str__(self):
+        return self.description or f"HTTP {self.status_code}: {self.text[:500]}"
+
+def _raise_for_status(response):
+    """Fail on 4xx/5xx before decoding JSON; only this path reads the body as text."""
+    if response.status_code >= 400:
+        raise SlurmRestError(response.status_code, response.text)
+
+class _TokenCache:
+    """Hold the last token from scontrol and when it should be refreshed."""
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()  # one scontrol run even when many threads ask at once
+
+    def get(self):
+        with self.lock:
+            if self.token is None or monotonic() > self.expires_at:
+                self.token = self.fetch()
+                # refresh at 90% of the lifespan so a token never expires mid-request
+                self.expires_at = monotonic() + TOKEN_LIFESPAN * 0.9
+            return self.token
+
+    @staticmethod
+    def fetch():
+        """Run scontrol token and return the token (text after '=')."""
+        result = subprocess.run(SCONTROL_CMD, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Command failed with return code {result.returncode}: {result.stderr}")
+        output = result.stdout.strip()
+        if '=' in output:
+            return output.split('=', 1)[1]
+        raise ValueError("Unexpected output format")
+
+_TOKEN_CACHE = _TokenCache()
+
 def get_token():
-    """Run scontrol token and return the token (text after '=')."""
-    result = subprocess.run(SCONTROL_CMD, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Command failed with return code {result.returncode}: {result.stderr}")
-    output = result.stdout.strip()
-    if '=' in output:
-        return output.split('=', 1)[1]
-    raise ValueError("Unexpected output format")
-
-def probe_restapi(resource, endpoint):
-    """Call SLURM REST API and return (json, status_code)."""
-    url = f"{SLURM_CONTROLLER}/{resource}/{API_VERSION}/{endpoint}"
-    headers = {"X-SLURM-USER-TOKEN": token}
-    response = requests.get(url, headers=headers)
-    return response.json(), response.status_code
+    """Return a cached token, only re-running scontrol once it is near expiry."""
+    return _TOKEN_CACHE.get()
+
+def _resolve_token():
+    """$SLURM_JWT if set, otherwise the cached scontrol token."""
+    return _ENV_JWT or get_token()
+
+def make_session(token):
+    """Return a requests.Session carrying `token`, with a pooled adapter.
+
+    The adapter does not retry: _get_with_retry is the only retry layer, so backoff
+    sleeps never hold an _INFLIGHT slot and attempts don't multiply.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"X-SLURM-USER-TOKEN": token})
+    return session
+
+def get_session():
+    """Return the process-wide SESSION, creating it on first use.
+
+    The token header is refreshed on every call, so a token rotated by _TokenCache
+    reaches the next request instead of the session keeping the original one.
+    """
+    global SESSION
+    token = _resolve_token()
+    with _SESSION_LOCK:
+        if SESSION is None:
+            SESSION = make_session(token)
+        elif SESSION.headers.get("X-SLURM-USER-TOKEN") != token:
+            SESSION.headers["X-SLURM-USER-TOKEN"] = token
+    return SESSION
+
+def _retry_delay(attempt):
+    """Jittered exponential backoff so throttled callers don't retry in lockstep."""
+    return random.uniform(0.05, 0.2) * 2 ** attempt
+
+def _get_with_retry(session, url, headers):
+    get = session.get
+    for attempt in range(REST_ATTEMPTS):
+        last = attempt == REST_ATTEMPTS - 1
+        try:
+            with _INFLIGHT:
+                response = get(url, headers=headers, timeout=REST_TIMEOUT)
+        except (requests.ConnectionError, requests.ReadTimeout):
+            if last:
+                raise
+        else:
+            if last or response.status_code not in _RETRY_STATUSES:
+                return response
+        sleep(_retry_delay(attempt))
+
+def probe_restapi(resource, endpoint, payload=None, session=None, direct=False):
+    """Call SLURM REST API and return (json, status_code). POSTs `payload` when given.
+
+    Uses `session` if given, otherwise the shared one from get_session(). `direct=True`
+    reads from SLURM_CONTROLLER even when SLURM_REST_CACHE_URL is set.
+    Raises SlurmRestError on a 4xx/5xx response. A body replayed on 304 is the same object
+    returned for the original GET, so treat results as read-only.
+    """
+    session = session or get_session()
+    if payload is not None:
+        # writes always go straight to the controller
+        url = _DIRECT_URL_PREFIX[resource] + endpoint
+        # not retried: a submit that reached the controller must not be repeated
+        with _INFLIGHT:
+            response = session.post(url, json=payload, timeout=REST_TIMEOUT)
+        _raise_for_status(response)
+        return json_loads(response.content), response.status_code
+
+    url = (_DIRECT_URL_PREFIX if direct else _READ_URL_PREFIX)[resource] + endpoint
+    cached = _ETAGS.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else None
+    response = _get_with_retry(session, url, headers)
+    if response.status_code == 304 and cached:
+        return cached[1], cached[2]
+    _raise_for_status(response)
+    body = json_loads(response.content)
+    if 'ETag' in response.headers:
+        with _ETAGS_LOCK:
+            _ETAGS.pop(url, None)
+            if len(_ETAGS) >= ETAG_CACHE_SIZE:
+                del _ETAGS[next(iter(_ETAGS))]
+            _ETAGS[url] = (response.headers['ETag'], body, response.status_code)
+    return body, response.status_code
+
+def probe_many(pairs):
+    """Run probe_restapi for each (resource, endpoint) pair concurrently; results keep input order."""
+    return list(_POOL.map(lambda pair: probe_restapi(*pair), pairs))
+
+def ttl_cache(seconds, maxsize=64):
+    """Decorator that memoizes results by positional args for `seconds`; adds cache_clear()."""
+    def decorator(func):
+        cache = {}
+
+        @wraps(func)
+        def wrapper(*args):
+            hit = cache.get(args)
+            if hit and monotonic() < hit[0]:
+                return hit[1]
+            if len(cache) >= maxsize:
+                cache.clear()
+            value = func(*args)
+            cache[args] = (monotonic() + seconds, value)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+@lru_cache(maxsize=128)
+def _query_job(jobid, time_bucket):
+    """Job lookup memoized per (jobid, second) so tight polling loops reuse one response.
+
+    Every caller in the same second gets the same dict; query_slurm hands out copies.
+    """
+    response, status_code = probe_restapi('slurm', f"job/{jobid}")
+    return response['jobs'][0]
+
+@ttl_cache(QOS_CACHE_TTL)
+def _query_userqos(user):
+    """Association QoS rarely changes during a run, so lookups are reused for QOS_CACHE_TTL.
+
+    The allowed QoS list is frozen into a tuple, since every caller shares the cached value.
+    """
+    response, status_code = probe_restapi('slurmdb', f"associations?user={user}")
+    return (tuple(response['associations'][0]['qos']), response['associations'][0]['default']['qos'])
+
+def clear_qos_cache():
+    """Forget cached QoS lookups, for tests that change associations and need fresh values."""
+    _query_userqos.cache_clear()
 
 def query_slurm(query_type, value):
     if query_type == "jobid":
-        response, status_code = probe_restapi('slurm', f"job/{value}")
-        try:
-            return response['jobs'][0]
-        except IndexError:
-            raise Exception(response['errors'][0]['description'])
+        # copy so a test editing its self.details can't alter what other callers see
+        return copy.deepcopy(_query_job(value, int(monotonic())))
     elif query_type == "userqos":
-        response, status_code = probe_restapi('slurmdb', f"associations?user={value}")
-        return (response['associations'][0]['qos'], response['associations'][0]['default']['qos'])
+        return _query_userqos(value)
+
+def query_slurm_many(jobids):
+    """Fetch several jobs with one REST call and return them as {jobid: job}.
+
+    Read straight from the controller: a cached job list can predate jobs submitted just now.
+    """
+    wanted = set(jobids)
+    response, status_code = probe_restapi('slurm', "jobs", direct=True)
+    # copy out of the body kept for 304 replays, as query_slurm('jobid') does
+    return {job['job_id']: copy.deepcopy(job) for job in response['jobs'] if job['job_id'] in wanted}
+
+def wait_for(jobids, terminal_states=_TERMINAL_STATES, timeout=None):
+    """Poll until every job in `jobids` reaches a terminal state and return {jobid: job}.
+
+    All jobs are checked with a single query per poll, backing off from 200ms up to 5s.
+    Raises LookupError if a job is unknown or already purged, since it would never finish.
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    delay = 0.2
+    while True:
+        jobs = query_slurm_many(jobids)
+        missing = set(jobids) - jobs.keys()
+        if missing:
+            raise LookupError(f"Jobs {sorted(missing)} not found (unknown or already purged)")
+        if all(set(job['job_state']) & set(terminal_states) for job in jobs.values()):
+            return jobs
+        if deadline is not None and monotonic() + delay > deadline:
+            raise TimeoutError(f"Jobs {sorted(jobids)} did not finish within {timeout}s")
+        sleep(delay)
+        delay = min(5.0, delay * 1.7)
+
+def make_async_client(token):
+    """Return an httpx.AsyncClient carrying `token`, sized for many concurrent polls."""
+    if httpx is None:
+        raise ImportError("httpx is required for the async REST helpers (pip install httpx)")
+    return httpx.AsyncClient(
+        headers={"X-SLURM-USER-TOKEN": token},
+        limits=httpx.Limits(max_connections=_ASYNC_MAX_CONNECTIONS, max_keepalive_connections=16),
+        timeout=httpx.Timeout(REST_TIMEOUT[1], connect=REST_TIMEOUT[0]),
+        http2=_HTTP2,
+    )
+
+async def probe_restapi_async(client, resource, endpoint, semaphore):
+    """Async counterpart of probe_restapi (GET only); returns (json, status_code).
+
+    `semaphore` is an asyncio.Semaphore shared by every call in the fan-out; it caps the
+    async calls in flight (separately from the sync _INFLIGHT limit).
+    """
+    url = _READ_URL_PREFIX[resource] + endpoint
+    for attempt in range(REST_ATTEMPTS):
+        last = attempt == REST_ATTEMPTS - 1
+        try:
+            async with semaphore:
+                response = await client.get(url)
+        except httpx.TransportError:  # connect/read errors, timeouts, connection resets
+            if last:
+                raise
+        else:
+            if last or response.status_code not in _RETRY_STATUSES:
+                _raise_for_status(response)
+                return json_loads(response.content), response.status_code
+        await asyncio.sleep(_retry_delay(attempt))
+
+async def _query_jobs_async(jobids):
+    # more waiters than connections would only queue inside httpx, so cap at the pool size
+    semaphore = asyncio.Semaphore(min(_MAX_INFLIGHT, _ASYNC_MAX_CONNECTIONS))
+    async with make_async_client(_resolve_token()) as client:
+        results = await asyncio.gather(*[probe_restapi_async(client, 'slurm', f"job/{jobid}", semaphore)
+                                         for jobid in jobids])
+    return {jobid: response['jobs'][0] for jobid, (response, status_code) in zip(jobids, results)}
+
+def run_sync(coroutine):
+    """Run `coroutine` to completion from synchronous (test) code."""
+    return asyncio.run(coroutine)
+
+def query_jobs_async(jobids):
+    """Fetch each job in `jobids` with concurrent GETs and return {jobid: job}."""
+    return run_sync(_query_jobs_async(jobids))
+
+def _sbatch_argv(params):
+    """Build the sbatch argv for `params` (an argument string or an already-split list)."""
+    if isinstance(params, str):
+        params = shlex.split(params)
+    return [*_SBATCH_ARGV, *params]
+
+def _parse_output(stdout):
+    """Return the job id sbatch reported, or raise SlurmSubmissionError if it reported none."""
+    m = _JOBID_RE.search(stdout)
+    if m:
+        return int(m.group(1))
+    # e.g. --parsable prints only the id; anything unexpected is a failed submission here
+    parsed = stdout.decode('utf-8', 'replace').splitlines()
+    raise SlurmSubmissionError(f"sbatch did not report a job id: {parsed[-1] if parsed else '(no output)'}",
+                               parsed)
+
+def _submission_error(stderr):
+    """Build the SlurmSubmissionError for a failed sbatch; only this path decodes its output."""
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode('utf-8', 'replace')
+    parsed = stderr.splitlines()
+    return SlurmSubmissionError(parsed[-1], parsed)
+
+def _rest_job_props(argv):
+    """Translate sbatch options into REST job fields, or None if any option is not in _REST_OPTIONS."""
+    props = {}
+    args = iter(argv)
+    for arg in args:
+        # only long options take an attached "=value"; sbatch reads "-p=x" as partition "=x"
+        opt, sep, value = arg.partition('=') if arg.startswith('--') else (arg, '', '')
+        if opt not in _REST_OPTIONS:
+            return None
+        if not sep:
+            value = next(args, None)
+            if value is None:
+                return None
+        field = _REST_OPTIONS[opt]
+        if field == "memory_per_node":
+            m = _MEM_RE.fullmatch(value)
+            if not m:
+                return None
+            kb = int(m.group(1)) * _MEM_UNITS_KB[m.group(2).upper()]
+            # round up to whole MB: only an explicit 0 may mean "all memory on the node"
+            value = {"set": True, "number": -(-kb // 1024)}
+        props[field] = value
+    return props
+
+def _rest_props_for(params):
+    """Job fields to submit `params` over REST, or None when it has to go through sbatch."""
+    if not USE_RESTD:
+        return None
+    # Blank or unrecognised options still go through sbatch so its error text is what tests see.
+    job_props = _rest_job_props(shlex.split(params) if isinstance(params, str) else params)
+    return job_props if job_props and "partition" in job_props else None
+
+def submit_via_rest(script, job_props):
+    """Submit `script` through slurmrestd with `job_props` and return the new job id."""
+    job = {**REST_JOB_DEFAULTS,
+           "begin_time": {"set": True, "number": int(time()) + 1},
+           **job_props}
+    try:
+        response, status_code = probe_restapi('slurm', "job/submit", {"script": script, "job": job})
+    except SlurmRestError as e:
+        # rejections (e.g. from job_submit.lua) come back as a 500; str(e) is their description
+        raise SlurmSubmissionError(str(e), e.errors or e.text)
+    if response.get('errors'):
+        raise SlurmSubmissionError(response['errors'][0]['description'], response['errors'])
+    return response['job_id']
 
 def run(params):
-    """Convenience function to submit a job and return its job-info response."""
-    def run_sbatch(params_list):
+    """Convenience function to submit a job and return its job-info response.
+
+    `params` may be an sbatch argument string or an already-split list.
+    """
+    def run_sbatch(argv):
         try:
-            proc = subprocess.Popen(shlex.split(params_list), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-            stdout, stderr = proc.communicate()
+            # close_fds=False: the child execs sbatch immediately, nothing to leak (and enables posix_spawn)
+            proc = subprocess.run(argv, capture_output=True, check=False, close_fds=False)
             if proc.returncode != 0:
-                return None, stderr
-            return stdout, stderr
+                return None, proc.stderr
+            return proc.stdout, proc.stderr
         except Exception as e:
             return None, str(e)
 
-    def parse_output(stdout):
-        job_id_pattern = re.compile(r'Submitted batch job (\d+)')
-        for line in stdout.splitlines():
-            m = job_id_pattern.search(line)
-            if m:
-                return int(m.group(1))
-        return stdout.splitlines()
+    job_props = _rest_props_for(params)
+    if job_props:
+        return query_slurm('jobid', submit_via_rest(REST_JOB_SCRIPT, job_props))
 
-    sbatch_params = f"sbatch {SBATCH_BEGIN} {SBATCH_WRAP} {TEMPORARY_ADDITIONS}{params}"
-    stdout, stderr = run_sbatch(sbatch_params)
+    stdout, stderr = run_sbatch(_sbatch_argv(params))
 
-    if stdout:
-        jobid = parse_output(stdout)
+    if stdout is not None:
+        jobid = _parse_output(stdout)
         response = query_slurm('jobid', jobid)
         return response
     else:
-        parsed = parse_output(stderr)
-        raise SlurmSubmissionError(parsed[-1], parsed)
+        raise _submission_error(stderr)
+
+def run_batch(params_list):
+    """Submit several jobs at once and return their job-info responses, in order.
+
+    Each entry still needs its own sbatch (job_submit.lua sees per-job options, so they
+    cannot share one --array job), but all sbatch processes run concurrently and the
+    resulting jobs are fetched with a single REST call instead of one per job.
+    With USE_RESTD, entries run() would submit over REST are submitted the same way here.
+
+    If any submission fails, the first failure (in input order) is raised as a
+    SlurmSubmissionError once every sbatch has finished. The sbatch entries all start
+    together, so they may have queued jobs by then; REST entries after the first failure
+    are not submitted.
+    """
+    props_list = [_rest_props_for(params) for params in params_list]
+    procs, failures = {}, {}
+    try:
+        for i, (params, job_props) in enumerate(zip(params_list, props_list)):
+            if not job_props:
+                try:
+                    procs[i] = subprocess.Popen(_sbatch_argv(params), stdout=subprocess.PIPE,
+                                                stderr=subprocess.PIPE, close_fds=False)
+                except OSError as e:
+                    # same as run(): sbatch missing, fd exhaustion, ... is a failed submission
+                    failures[i] = _submission_error(str(e))
+    finally:
+        # reap every started sbatch, even if something unexpected was raised above
+        outputs = {i: (proc.communicate(), proc.returncode) for i, proc in procs.items()}
+
+    jobids = []
+    for i, job_props in enumerate(props_list):
+        if i in failures:
+            raise failures[i]
+        if job_props:
+            jobids.append(submit_via_rest(REST_JOB_SCRIPT, job_props))
+            continue
+        (stdout, stderr), returncode = outputs[i]
+        if returncode != 0:
+            raise _submission_error(stderr)
+        jobids.append(_parse_output(stdout))
+
+    jobs = query_slurm_many(jobids)
+    return [jobs[jobid] for jobid in jobids]
 
 # ------------------ Unit-test decorators (cleaned & active) ------------------
 
+# (field, flag, expected) checked on every job by common_slurm_checks
+_COMMON_CHECKS = (
+    ('cpus', 'set', True),
+    ('cpus', 'infinite', False),
+    ('time_limit', 'set', True),
+    ('time_limit', 'infinite', False),
+)
+
 def common_slurm_checks(func):
     """Decorator to perform common SLURM assertions after a test runs.
 
@@ -96,16 +550,12 @@ def common_slurm_checks(func):
     def wrapper(self, *args, **kwargs):
         func(self, *args, **kwargs)  # run the test (should set self.details)
 
-        # Basic CPU assertions (mirror original behavior)
-        self.assertEqual(self.details['cpus']['set'], True)
-        self.assertEqual(self.details['cpus']['infinite'], False)
-
-        # Time-limit assertions
-        self.assertEqual(self.details['time_limit']['set'], True)
-        self.assertEqual(self.details['time_limit']['infinite'], False)
+        # Basic CPU and time-limit assertions (mirror original behavior)
+        for field, flag, expected in _COMMON_CHECKS:
+            self.assertEqual(self.details[field][flag], expected)
 
         # Mail user asserted to be "<USER>@example.edu"
-        # self.assertEqual(self.details['mail_user'], f"{getenv('USER')}@example.edu")
+        # self.assertEqual(self.details['mail_user'], f"{_ENV_USER}@example.edu")
 
     return wrapper
 
@@ -129,46 +579,66 @@ def expect_tres(assertions_dict):
         return wrapper
     return decorator
 
+_MISSING = object()
+
+def _mk_checker(key, expected_value):
+    """Specialize the expect_equal rules for one key, so the branch on `expected_value` runs once.
+
+    The returned checker is called as check(self, actual) with actual = self.details.get(key, _MISSING).
+    """
+    # If expected is a tuple -> treat as multiple expected tokens in a comma-separated string.
+    if isinstance(expected_value, tuple):
+        def check(self, actual):
+            # If the stored field is a dict, compare against its 'number' entry.
+            if isinstance(actual, dict):
+                self.assertEqual(expected_value, actual['number'])
+                return
+            with self.subTest(key=key):
+                # Ensure key exists
+                self.assertIn(key, self.details)
+
+                actual_vals = actual.split(',')
+                # Ensure counts match
+                self.assertEqual(len(expected_value), len(actual_vals),
+                                 f"Expected {len(expected_value)} values for key '{key}', "
+                                 f"but got {len(actual_vals)}")
+                # Ensure each expected member is present (exact token match)
+                actual_set = set(actual_vals)
+                for value in expected_value:
+                    with self.subTest(value=value):
+                        self.assertIn(value, actual_set)
+        return check
+
+    def check(self, actual):
+        # If the stored field is a dict, compare against its 'number' entry.
+        if isinstance(actual, dict):
+            self.assertEqual(expected_value, actual['number'])
+            return
+        # Default: ensure key exists and value equals expected_value
+        self.assertIn(key, self.details)
+        self.assertEqual(actual, expected_value)
+    return check
+
 def expect_equal(assertions_dict):
     """Decorator factory that checks a dictionary of expected values against self.details.
 
     Rules preserved from original:
     - If self.details[key] is a dict, compare against self.details[key]['number'].
     - If expected value is a tuple, ensure the value string in details splits into the same count
-      and contains each expected member (subTest used for clarity).
+      and contains each expected member as an exact comma-separated token (subTest used for clarity).
     - Otherwise, assert key exists and equals expected value.
+
+    The per-key checks are built once here, at decoration time (see _mk_checker).
     """
+    plan = [(key, _mk_checker(key, expected)) for key, expected in assertions_dict.items()]
+
     def decorator(func):
         @wraps(func)
         def wrapper(self, *args, **kwargs):
             func(self, *args, **kwargs)  # run the test (should set self.details)
 
-            for key, expected_value in assertions_dict.items():
-                # If the stored field is a dict, compare against its 'number' entry.
-                if isinstance(self.details.get(key), dict):
-                    self.assertEqual(expected_value, self.details[key]['number'])
-                    continue
-
-                # If expected is a tuple -> treat as multiple expected tokens in a comma-separated string.
-                if isinstance(expected_value, tuple):
-                    with self.subTest(key=key):
-                        # Ensure key exists
-                        self.assertIn(key, self.details)
-
-                        actual_vals = self.details[key].split(',')
-                        # Ensure counts match
-                        self.assertEqual(len(expected_value), len(actual_vals),
-                                         f"Expected {len(expected_value)} values for key '{key}', "
-                                         f"but got {len(actual_vals)}")
-                        # Ensure each expected member is present
-                        for value in expected_value:
-                            with self.subTest(value=value):
-                                self.assertIn(value, self.details[key])
-                    continue
-
-                # Default: ensure key exists and value equals expected_value
-                self.assertIn(key, self.details)
-                self.assertEqual(self.details[key], expected_value)
+            for key, check in plan:
+                check(self, self.details.get(key, _MISSING))
 
         return wrapper
     return decorator
@@ -193,6 +663,12 @@ def raise_with_message(exception_type, expected_message):
 # --------------------------- Unit tests ------------------------------------
 
 class TestSlurm(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Resolve the token here rather than in __main__ so pytest (and pytest -n) can run the suite,
+        # and so a missing token fails once up front instead of in every test.
+        get_session()
+
     def setUp(self):
         pass
 
@@ -212,10 +688,7 @@ class TestSlurm(unittest.TestCase):
 # --------------------------- Entry point -----------------------------------
 
 if __name__ == '__main__':
-    if getenv('SLURM_JWT'):
-        print(f"Using environment-based token $SLURM_JWT")
-        token = getenv('SLURM_JWT')
-    else:
-        token = get_token()
+    if _ENV_JWT:
+        print(f"Using environment-based token from $SLURM_JWT ({len(_ENV_JWT)} chars)")
 
     unittest.main()